@@ -1,18 +1,64 @@
+import functools
 import json
 import os
 import random
 import re
 import time
 from datetime import datetime
+from itertools import islice
+from typing import TYPE_CHECKING
 from zoneinfo import ZoneInfo
 
-import tweepy
-from tweepy.errors import Forbidden, TooManyRequests, TwitterServerError
+if TYPE_CHECKING:
+    import tweepy
+
+try:
+    import orjson
+except ImportError:  # Optional: stdlib json parses the same files, just slower.
+    orjson = None
 
 TOP_N = 3
 COOLDOWN_MINUTES = 120
 HEADLINE_REPOST_WINDOW_HOURS = 48
 MAX_TAKEAWAY_LEN = 120
+RATE_LIMIT_MAX_WAIT_SECONDS = 300
+X_HTTP_TIMEOUT = (3, 15)  # (connect, read) seconds
+SITE_URL = "https://ai-news-app-iota.vercel.app/"
+MAX_LINK_LEN = 230
+# Where to keep the last-post record; unset (the default for local runs) disables it.
+LAST_POST_PATH = os.environ.get("X_LAST_POST_PATH", "").strip()
+
+_WS_RE = re.compile(r"\s+")
+_TZ_NY = ZoneInfo("America/New_York")
+_TZ_UTC = ZoneInfo("UTC")
+# Tweets posted by this script; any of these inside the cooldown blocks a new post.
+_COOLDOWN_PREFIXES = ("🤖 AI Update:", "AI update test", "Links:")
+
+TWEET_MAX_WEIGHT = 280
+# X wraps every link in t.co, so a URL always counts as this many characters.
+TCO_URL_WEIGHT = 23
+# Code points X counts as weight 1 (twitter-text v3), besides U+0000-U+10FF;
+# everything else counts 2.
+_LIGHT_RANGES = ((8192, 8205), (8208, 8223), (8242, 8247))
+TWEET_TEMPLATE = "🤖 AI Update: {title}\n\nKey takeaway: {takeaway}\n\n🔗 {link} #AI #Tech"
+
+
+def _char_weight(ch: str) -> int:
+    cp = ord(ch)
+    if cp <= 4351:
+        return 1
+    return 1 if any(lo <= cp <= hi for lo, hi in _LIGHT_RANGES) else 2
+
+
+def weighted_len(text: str) -> int:
+    if text.isascii():
+        return len(text)
+    return sum(map(_char_weight, text))
+
+
+_ELLIPSIS_WEIGHT = _char_weight("…")
+# Weight of the fixed template text, so sizing a tweet is plain arithmetic.
+_TWEET_STATIC_WEIGHT = weighted_len(TWEET_TEMPLATE.format(title="", takeaway="", link=""))
 
 
 TOPIC_KEYWORDS = {
@@ -34,8 +80,18 @@ TOPIC_KEYWORDS = {
 }
 
 
+def _collapse_ws(text: str) -> str:
+    text = text or ""
+    # Titles are usually single-line and already clean: isprintable() rejects
+    # every whitespace character except the plain space, so only runs of
+    # spaces and leading/trailing spaces remain to check before skipping the sub.
+    if not text.isprintable() or "  " in text or text[:1] == " " or text[-1:] == " ":
+        text = _WS_RE.sub(" ", text).strip()
+    return text
+
+
 def truncate(text: str, max_len: int) -> str:
-    text = " ".join((text or "").split())
+    text = _collapse_ws(text)
     if len(text) <= max_len:
         return text
     if max_len <= 0:
@@ -48,19 +104,42 @@ def truncate(text: str, max_len: int) -> str:
     return f"{cut}…"
 
 
+def truncate_weighted(text: str, limit: int) -> str:
+    """Like truncate(), but limit is X's weighted length rather than code points."""
+    text = _collapse_ws(text)
+    if weighted_len(text) <= limit:
+        return text
+    budget = limit - _ELLIPSIS_WEIGHT
+    if budget < 0:
+        return ""
+    end = total = 0
+    for ch in text:
+        total += _char_weight(ch)
+        if total > budget:
+            break
+        end += 1
+    cut = text[:end].rstrip()
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0].rstrip()
+    return f"{cut}…"
+
+
 def read_top_news(path: str):
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return [x for x in data if x.get("title") and x.get("url")][:TOP_N]
+    with open(path, "rb") as f:
+        raw = f.read()
+    data = orjson.loads(raw) if orjson else json.loads(raw)
+    # Stop filtering as soon as TOP_N usable items have been found.
+    return list(islice((x for x in data if x.get("title") and x.get("url")), TOP_N))
 
 
 def normalize_text(text: str) -> str:
-    return re.sub(r"\s+", " ", re.sub(r"[^a-z0-9\s]", " ", (text or "").lower())).strip()
+    return _WS_RE.sub(" ", re.sub(r"[^a-z0-9\s]", " ", (text or "").lower())).strip()
 
 
 def resolve_final_url(url: str) -> str:
     # Product-first linking policy: always route traffic to Gaolai's AI news page.
-    return "https://ai-news-app-iota.vercel.app/"
+    # No network round trip is needed, so there is nothing to resolve or cache.
+    return SITE_URL
 
 
 def classify_topic(title: str, summary: str, source: str) -> str:
@@ -79,7 +158,7 @@ def classify_topic(title: str, summary: str, source: str) -> str:
 def sentence_from_summary(summary: str) -> str:
     if not summary:
         return ""
-    cleaned = re.sub(r"\s+", " ", summary).strip()
+    cleaned = _WS_RE.sub(" ", summary).strip()
     m = re.match(r"^([^.!?]*[.!?])", cleaned)
     return (m.group(1) if m else cleaned).strip()
 
@@ -89,7 +168,7 @@ def extract_signal_phrase(title: str, summary: str) -> str:
     if not base:
         base = title
     base = re.sub(r"\s*-\s*[^-]+$", "", base).strip()
-    base = re.sub(r"\s+", " ", base)
+    base = _WS_RE.sub(" ", base)
     return truncate(base, 70)
 
 
@@ -142,29 +221,34 @@ def get_distinct_takeaway(title: str, summary: str, source: str):
     return takeaway, topic
 
 
-def build_tweet_from_news(news, source: str):
+def build_tweet_from_news(news, source: str, link: str | None = None):
     item = news[0]
     raw_title = item.get("title", "")
     title = raw_title
-    link = resolve_final_url(item.get("url", ""))
+    if link is None:
+        link = resolve_final_url(item.get("url", ""))
     summary = item.get("summary", "")
 
     # Clean up title: remove source suffix if present (e.g. " - The Verge")
     if " - " in title:
         title = title.rsplit(" - ", 1)[0]
 
-    if len(link) > 230:
-        link = "https://ai-news-app-iota.vercel.app/"
+    if len(link) > MAX_LINK_LEN:
+        link = SITE_URL
 
     takeaway, topic = get_distinct_takeaway(title, summary, source)
 
-    header = f"🤖 AI Update: {title}"
-    tweet = f"{header}\n\nKey takeaway: {takeaway}\n\n🔗 {link} #AI #Tech"
+    fixed_weight = _TWEET_STATIC_WEIGHT + (TCO_URL_WEIGHT if link else 0)
+    title_weight = weighted_len(title)
+    takeaway_weight = weighted_len(takeaway)
+    overflow = fixed_weight + title_weight + takeaway_weight - TWEET_MAX_WEIGHT
+    if overflow > 0:
+        takeaway = truncate_weighted(takeaway, max(20, takeaway_weight - overflow))
+        overflow = fixed_weight + title_weight + weighted_len(takeaway) - TWEET_MAX_WEIGHT
+    if overflow > 0:
+        title = truncate_weighted(title, max(0, title_weight - overflow))
 
-    if len(tweet) > 280:
-        allowed_takeaway_len = max(20, MAX_TAKEAWAY_LEN - (len(tweet) - 280))
-        takeaway = truncate(takeaway, allowed_takeaway_len)
-        tweet = f"{header}\n\nKey takeaway: {takeaway}\n\n🔗 {link} #AI #Tech"
+    tweet = TWEET_TEMPLATE.format(title=title, takeaway=takeaway, link=link)
 
     return tweet, {
         "title_norm": normalize_text(title),
@@ -187,41 +271,153 @@ def _error_details(err: Exception) -> str:
     return " | ".join(bits) if bits else str(err)
 
 
-def create_tweet_with_retry(client: tweepy.Client, text: str, label: str, max_attempts: int = 3):
+def _rate_limit_reset_wait(err: Exception):
+    headers = getattr(getattr(err, "response", None), "headers", None) or {}
+    try:
+        return max(0.0, int(headers.get("x-rate-limit-reset")) - time.time() + 1)
+    except (TypeError, ValueError):
+        return None
+
+
+def _apply_http_timeout(client: "tweepy.Client", timeout):
+    # tweepy sends requests without a timeout, so a stalled connection could hang the job.
+    client.session.request = functools.partial(client.session.request, timeout=timeout)
+
+
+def create_tweet_with_retry(client: "tweepy.Client", text: str, label: str, max_attempts: int = 3):
+    import requests
+    from tweepy.errors import Forbidden, TooManyRequests, TwitterServerError
+
     for attempt in range(1, max_attempts + 1):
         try:
             return client.create_tweet(text=text)
-        except (TooManyRequests, TwitterServerError, Forbidden) as e:
+        # Only connect timeouts are retried: the request never reached X, so it cannot
+        # double-post. A read timeout propagates, since the tweet may already exist.
+        except (TooManyRequests, TwitterServerError, Forbidden, requests.ConnectTimeout) as e:
             details = _error_details(e)
             print(f"{label} attempt {attempt}/{max_attempts} failed: {details}")
             if attempt >= max_attempts:
                 raise
             sleep_s = min(60, (2 ** attempt) * 3) + random.uniform(0.0, 1.5)
+            if isinstance(e, TooManyRequests):
+                reset_wait = _rate_limit_reset_wait(e)
+                if reset_wait is not None:
+                    if reset_wait > RATE_LIMIT_MAX_WAIT_SECONDS:
+                        print(f"Rate limit resets in {reset_wait:.0f}s; not waiting.")
+                        raise
+                    sleep_s = max(sleep_s, reset_wait)
             print(f"Retrying in {sleep_s:.1f}s...")
             time.sleep(sleep_s)
 
 
-def main():
-    api_key = os.environ["X_API_KEY"]
-    api_secret = os.environ["X_API_SECRET"]
-    access_token = os.environ["X_ACCESS_TOKEN"]
-    access_token_secret = os.environ["X_ACCESS_TOKEN_SECRET"]
+def read_last_post(path: str):
+    if not path:
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        ts = float(data["ts"])
+    except (OSError, ValueError, TypeError, KeyError):
+        return None
+    return {"ts": ts, "tweet_id": data.get("tweet_id"), "text": str(data.get("text") or "")}
 
-    test_text = os.environ.get("X_TEST_TEXT", "").strip()
-    preview_only = os.environ.get("X_PREVIEW_ONLY", "false").strip().lower() == "true"
+
+def _write_json_atomic(path: str, data):
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not write {path}: {e}")
+
+
+def write_last_post(path: str, text: str, tweet_id):
+    if not path:
+        return
+    _write_json_atomic(path, {"ts": time.time(), "tweet_id": tweet_id, "text": text})
+
+
+def forget_last_post(path: str):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Could not remove {path}: {e}")
+
+
+def post_and_record(client: "tweepy.Client", text: str, label: str):
+    import requests
+
+    try:
+        resp = create_tweet_with_retry(client, text=text, label=label)
+    except requests.ReadTimeout:
+        # X may have created the tweet without us seeing the response. Drop the
+        # record so the next run falls back to reading the timeline.
+        print(f"{label} timed out waiting for X; clearing the last-post record.")
+        forget_last_post(LAST_POST_PATH)
+        raise
+    tweet_id = resp.data.get("id") if getattr(resp, "data", None) else None
+    write_last_post(LAST_POST_PATH, text, tweet_id)
+    return tweet_id
+
+
+def uid_from_access_token(access_token: str):
+    # X OAuth 1.0a access tokens look like "<user_id>-<random>", so the
+    # authenticated user's id comes with the credentials, no get_me needed.
+    prefix = (access_token or "").split("-", 1)[0]
+    return prefix if prefix.isascii() and prefix.isdigit() else None
+
+
+def make_client() -> "tweepy.Client":
+    # Imported here so importing this module and the early-exit paths of
+    # main() never pay for loading tweepy.
+    import tweepy
 
     client = tweepy.Client(
-        consumer_key=api_key,
-        consumer_secret=api_secret,
-        access_token=access_token,
-        access_token_secret=access_token_secret,
+        consumer_key=os.environ["X_API_KEY"],
+        consumer_secret=os.environ["X_API_SECRET"],
+        access_token=os.environ["X_ACCESS_TOKEN"],
+        access_token_secret=os.environ["X_ACCESS_TOKEN_SECRET"],
     )
+    _apply_http_timeout(client, X_HTTP_TIMEOUT)
+    return client
+
+
+def post_daily_tweet(client: "tweepy.Client", tweet_text: str):
+    from tweepy.errors import Forbidden
+
+    try:
+        tweet_id = post_and_record(client, tweet_text, "Primary post")
+        print("Posted to X successfully.")
+        if tweet_id:
+            print(f"Tweet ID: {tweet_id}")
+    except Forbidden as e:
+        fallback = f"AI update test {datetime.now(_TZ_NY).strftime('%Y-%m-%d %H:%M:%S ET')}"
+        print("Primary post forbidden after retries; trying fallback text...")
+        print(f"Primary error details: {_error_details(e)}")
+        print(f"Fallback preview: {fallback}")
+        try:
+            tweet_id = post_and_record(client, fallback, "Fallback post")
+            print("Posted fallback to X successfully.")
+            if tweet_id:
+                print(f"Tweet ID: {tweet_id}")
+        except Forbidden:
+            raise e
+
+
+def main():
+    test_text = os.environ.get("X_TEST_TEXT", "").strip()
+    preview_only = os.environ.get("X_PREVIEW_ONLY", "false").strip().lower() == "true"
 
     if test_text:
-        tweet_text = truncate(test_text, 280)
-        print("Using X_TEST_TEXT override.")
-        print("Tweet preview:")
-        print(tweet_text)
+        client = make_client()
+        tweet_text = truncate_weighted(test_text, TWEET_MAX_WEIGHT)
+        print(f"Using X_TEST_TEXT override.\nTweet preview:\n{tweet_text}")
+        # Diagnostic posts are not recorded, so they never block the daily post.
         resp = create_tweet_with_retry(client, text=tweet_text, label="Test post")
         tweet_id = resp.data.get("id") if getattr(resp, "data", None) else None
         print("Posted to X successfully.")
@@ -237,31 +433,59 @@ def main():
         print("Preview mode enabled (no posting).")
         for i, item in enumerate(news[:3], start=1):
             preview_text, preview_meta = build_tweet_from_news([item], item.get("source", ""))
-            print(f"\n=== PREVIEW {i} ===")
-            print(f"topic: {preview_meta.get('topic', 'n/a')}")
-            print(f"takeaway: {preview_meta.get('final_takeaway', '')}")
-            print(preview_text)
+            print("\n".join((
+                f"\n=== PREVIEW {i} ===",
+                f"topic: {preview_meta.get('topic', 'n/a')}",
+                f"takeaway: {preview_meta.get('final_takeaway', '')}",
+                preview_text,
+            )))
         return
 
-    tweet_text, meta = build_tweet_from_news(news, news[0].get("source", ""))
+    # Resolve once here so nothing later in the run (including retries) repeats it.
+    top = news[0]
+    link = resolve_final_url(top.get("url", ""))
+    tweet_text, meta = build_tweet_from_news(news, top.get("source", ""), link)
     top_headline_norm = meta.get("title_norm", "")
     top_raw_headline_norm = meta.get("raw_title_norm", "")
     top_link = meta.get("link", "")
 
-    print("Debug:")
-    print(f"- topic: {meta.get('topic', 'n/a')}")
-    print(f"- source summary: {meta.get('source_summary', '')}")
-    print(f"- final takeaway: {meta.get('final_takeaway', '')}")
-    print("Tweet preview:")
-    print(tweet_text)
+    print("\n".join((
+        "Debug:",
+        f"- topic: {meta.get('topic', 'n/a')}",
+        f"- source summary: {meta.get('source_summary', '')}",
+        f"- final takeaway: {meta.get('final_takeaway', '')}",
+        "Tweet preview:",
+        tweet_text,
+    )))
 
     # Prevent duplicate daily brief posts + rapid retries.
+    # The local record of the last post can only cause a skip (saving the API
+    # reads); otherwise the timeline check still runs, since it also sees manual
+    # posts and any other post the record does not hold.
+    last_post = read_last_post(LAST_POST_PATH)
+    if last_post is not None:
+        age_min = (time.time() - last_post["ts"]) / 60.0
+        if age_min < COOLDOWN_MINUTES and last_post["text"].startswith(_COOLDOWN_PREFIXES):
+            print(f"Skip: cooldown active ({age_min:.0f} min < {COOLDOWN_MINUTES} min).")
+            return
+        if age_min / 60.0 < HEADLINE_REPOST_WINDOW_HOURS:
+            last_norm = normalize_text(last_post["text"])
+            same_clean_title = bool(top_headline_norm and top_headline_norm in last_norm)
+            same_raw_title = bool(top_raw_headline_norm and top_raw_headline_norm in last_norm)
+            if same_clean_title or same_raw_title:
+                print(f"Skip: same story already posted within {HEADLINE_REPOST_WINDOW_HOURS}h.")
+                return
+
+    client = make_client()
+
     try:
-        me = client.get_me(user_auth=True)
-        uid = me.data.id if getattr(me, "data", None) else None
+        uid = uid_from_access_token(os.environ["X_ACCESS_TOKEN"])
+        if uid is None:
+            me = client.get_me(user_auth=True)
+            uid = me.data.id if getattr(me, "data", None) else None
         if uid:
             recent = client.get_users_tweets(id=uid, max_results=10, user_auth=True, tweet_fields=["created_at"])
-            now_utc = datetime.now(ZoneInfo("UTC"))
+            now_utc = datetime.now(_TZ_UTC)
             for t in (recent.data or []):
                 txt = t.text or ""
 
@@ -270,11 +494,7 @@ def main():
                     age_min = (now_utc - created_at).total_seconds() / 60.0
                     age_hours = age_min / 60.0
 
-                    if age_min < COOLDOWN_MINUTES and (
-                        txt.startswith("🤖 AI Update:")
-                        or txt.startswith("AI update test")
-                        or txt.startswith("Links:")
-                    ):
+                    if age_min < COOLDOWN_MINUTES and txt.startswith(_COOLDOWN_PREFIXES):
                         print(f"Skip: cooldown active ({age_min:.0f} min < {COOLDOWN_MINUTES} min).")
                         return
 
@@ -289,25 +509,7 @@ def main():
     except Exception as e:
         print(f"Duplicate/cooldown check skipped due to API read issue: {e}")
 
-    try:
-        resp = create_tweet_with_retry(client, text=tweet_text, label="Primary post")
-        tweet_id = resp.data.get("id") if getattr(resp, "data", None) else None
-        print("Posted to X successfully.")
-        if tweet_id:
-            print(f"Tweet ID: {tweet_id}")
-    except Forbidden as e:
-        fallback = f"AI update test {datetime.now(ZoneInfo('America/New_York')).strftime('%Y-%m-%d %H:%M:%S ET')}"
-        print("Primary post forbidden after retries; trying fallback text...")
-        print(f"Primary error details: {_error_details(e)}")
-        print(f"Fallback preview: {fallback}")
-        try:
-            resp = create_tweet_with_retry(client, text=fallback, label="Fallback post")
-            tweet_id = resp.data.get("id") if getattr(resp, "data", None) else None
-            print("Posted fallback to X successfully.")
-            if tweet_id:
-                print(f"Tweet ID: {tweet_id}")
-        except Forbidden:
-            raise e
+    post_daily_tweet(client, tweet_text)
 
 
 if __name__ == "__main__":